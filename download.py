@@ -1,15 +1,20 @@
 #!/home/hitbox/venv-ytdlp/bin/python
 #!/usr/bin/env python
 import argparse
-import configparser
 import datetime
 import math
 import os
+import re
+import selectors
 import subprocess
 import sys
 import time
 
+from datetime import datetime as _dt
+from datetime import time as _time_cls
+from datetime import timedelta as _td
 from functools import cached_property
+from functools import lru_cache
 from operator import attrgetter
 from operator import itemgetter
 from operator import xor
@@ -24,18 +29,25 @@ except ImportError:
 # special string to indicate ini option is a flag
 IS_FLAG_VALUE = ':flag:'
 
+_combine = _dt.combine
+_one_day = _td(days=1)
+_midnight = _time_cls()
+
+# a line with something other than whitespace that isn't a comment
+_NON_EMPTY_RE = re.compile(r'[^\S\n]*[^#\s]')
+
 class spec_order:
 
     def __init__(self, jumps):
         self.jumps = jumps
+        # first position wins, like list.index
+        self._positions = {}
+        for index, name in enumerate(jumps):
+            self._positions.setdefault(name, index)
 
     def __call__(self, spec):
-        try:
-            # special jump order or...
-            return self.jumps.index(spec.name)
-        except ValueError:
-            # ...whatever order they're already in
-            return math.inf
+        # special jump order or whatever order they're already in
+        return self._positions.get(spec.name, math.inf)
 
 
 class DownloadData:
@@ -74,12 +86,14 @@ class DownloadData:
 
     @cached_property
     def env(self):
-        env = os.environ.copy()
-        if self.insert_path:
-            path_list = os.environ['PATH'].split(os.pathsep)
-            path_list.insert(0, self.insert_path)
-            env['PATH'] = os.pathsep.join(path_list)
-        return env
+        """
+        Environment for subprocesses or None to inherit ours unchanged.
+        """
+        if not self.insert_path:
+            return None
+        # insert path to front of PATH
+        path = f'{self.insert_path}{os.pathsep}{os.environ["PATH"]}'
+        return {**os.environ, 'PATH': path}
 
     def iter_enabled_specs(self):
         for spec in self.specs:
@@ -112,34 +126,45 @@ class Spec:
     def get_batch(self):
         return self.extra.get('batch')
 
-    def update_kwargs_for_timeout(self, downloads, run_kwargs, extra):
-        timeout_seconds = None
-        now = datetime.datetime.now()
-        matching = list(downloads.applicable_interval(now))
-        if len(matching) > 1:
+    def update_kwargs_for_timeout(self, downloads, now, run_kwargs):
+        """
+        Set the timeout for the interval matching `now`, if any, and return
+        its override options.
+        """
+        matching = downloads.applicable_interval(now)
+        first = next(matching, None)
+        if first is None:
+            return
+        if next(matching, None) is not None:
             raise ValueError('Multiple matching intervals.')
-        elif len(matching) == 1:
-            key, interval, remaining = matching[0]
-            # insert timeout args and command in reverse
-            timeout_timedelta = interval.duration(now)
-            timeout_seconds = timeout_timedelta.total_seconds()
-            run_kwargs['timeout'] = timeout_seconds
-            extra.update(remaining)
-
-    def cmdargs(self, dlargs, downloads, use_intervals):
+        key, interval, remaining = first
+        # insert timeout args and command in reverse
+        timeout_timedelta = interval.duration(now)
+        timeout_seconds = timeout_timedelta.total_seconds()
+        run_kwargs['timeout'] = timeout_seconds
+        return remaining
+
+    def cmdargs(self, dlargs, downloads, use_intervals, now=None):
         """
         :param dlargs: list of extra command line arguments for yt-dlp
+        :param now: datetime to match intervals against, defaults to now.
         """
         args = [downloads.python_exe, '-m', 'yt_dlp']
-        extra = self.extra.copy()
+        extra = self.extra
 
-        run_kwargs = dict(
-            env = downloads.env,
-        )
+        run_kwargs = {}
+        env = downloads.env
+        if env is not None:
+            run_kwargs['env'] = env
 
         # interval override options
         if use_intervals:
-            self.update_kwargs_for_timeout(downloads, run_kwargs, extra)
+            if now is None:
+                now = datetime.datetime.now()
+            remaining = self.update_kwargs_for_timeout(downloads, now, run_kwargs)
+            if remaining:
+                # copy only when overriding, leaving the spec's options alone
+                extra = {**extra, **remaining}
 
         # spec's remaining options in place
         add_remaining(args, extra)
@@ -164,39 +189,52 @@ class Interval:
     def __init__(self, from_dt, to_dt):
         self.from_dt = from_dt
         self.to_dt = to_dt
+        # time-only boundaries are combined with the date being matched
+        self._from_is_time = isinstance(from_dt, _time_cls)
+        self._to_is_time = isinstance(to_dt, _time_cls)
+        # specialize match for boundaries of the same kind
+        if self._from_is_time == self._to_is_time:
+            self._ordered = from_dt < to_dt
+            if self._from_is_time:
+                self.match = self._match_times
+            else:
+                self.match = self._match_datetimes
 
     def duration(self, dt):
-        to_dt = self.to_dt
-        if isinstance(to_dt, datetime.time):
-            to_dt = datetime.datetime.combine(dt.date(), to_dt)
+        to_dt = _combine(dt.date(), self.to_dt) if self._to_is_time else self.to_dt
 
         if dt <= to_dt:
             td = to_dt - dt
         else:
-            to_dt += datetime.timedelta(days=1)
-            next_midnight = datetime.datetime.combine(
-                dt.date() + datetime.timedelta(days=1),
-                datetime.time()
-            )
+            to_dt += _one_day
+            next_midnight = _combine(dt.date() + _one_day, _midnight)
             td = (next_midnight - dt) + (to_dt - next_midnight)
         return td
 
     def match(self, dt, print_=False):
-        combine = datetime.datetime.combine
-
-        from_dt = self.from_dt
-        if isinstance(from_dt, datetime.time):
-            from_dt = combine(dt.date(), from_dt)
-
-        to_dt = self.to_dt
-        if isinstance(to_dt, datetime.time):
-            to_dt = combine(dt.date(), to_dt)
+        date = dt.date()
+        from_dt = _combine(date, self.from_dt) if self._from_is_time else self.from_dt
+        to_dt = _combine(date, self.to_dt) if self._to_is_time else self.to_dt
 
         if from_dt < to_dt:
             return from_dt <= dt <= to_dt
         else:
             return dt >= from_dt or dt <= to_dt
 
+    def _match_times(self, dt, print_=False):
+        # same as combining both with dt's date
+        dt_time = dt.time()
+        if self._ordered:
+            return self.from_dt <= dt_time <= self.to_dt
+        else:
+            return dt_time >= self.from_dt or dt_time <= self.to_dt
+
+    def _match_datetimes(self, dt, print_=False):
+        if self._ordered:
+            return self.from_dt <= dt <= self.to_dt
+        else:
+            return dt >= self.from_dt or dt <= self.to_dt
+
 
 def safepop(section, key, getfunc='get', default=None):
     """
@@ -220,6 +258,7 @@ def safepop(section, key, getfunc='get', default=None):
         pass
     return value
 
+@lru_cache(maxsize=256)
 def resolve_datetime(string):
     strptime = datetime.datetime.strptime
     try:
@@ -254,11 +293,8 @@ def specs_from_config(cp, keys):
 
 def has_non_empty(path):
     with open(path) as batch_file:
-        for line in batch_file:
-            line = line.strip()
-            if line and not line.startswith('#'):
-                # non-empty line that's not a comment
-                return True
+        # stop at the first line with content, usually the first line
+        return any(map(_NON_EMPTY_RE.match, batch_file))
 
 def is_empty_batch(spec):
     return (
@@ -268,6 +304,22 @@ def is_empty_batch(spec):
         and not has_non_empty(spec['batch'])
     )
 
+def needs_interpolation(filenames):
+    """
+    Return true if any of the config files could use interpolation.
+    """
+    if isinstance(filenames, (str, bytes, os.PathLike)):
+        filenames = [filenames]
+    for filename in filenames:
+        try:
+            with open(filename, 'rb') as config_file:
+                if b'$' in config_file.read():
+                    return True
+        except OSError:
+            # configparser skips files it cannot open
+            continue
+    return False
+
 def add_remaining(args, data):
     for key, val in data.items():
         if key == 'urls' or val is None:
@@ -295,12 +347,6 @@ def parse_main(cp, jump_list=None):
     if any(jump_key not in keys for jump_key in jump_list):
         raise ValueError('Key in jump list not found.')
 
-    # insert path to front of PATH
-    env = os.environ.copy()
-    if insert_path:
-        path_list = [insert_path] + os.environ['PATH'].split(os.pathsep)
-        env['PATH'] = os.pathsep.join(path_list)
-
     # parse intervals
     use_intervals = safepop(section, 'use_intervals', 'getboolean')
     interval_keys = safepop(section, 'interval_keys', default='').split()
@@ -310,8 +356,9 @@ def parse_main(cp, jump_list=None):
         interval_sections = [cp[key] for key in interval_keys]
         intervals = list(map(parse_interval, interval_sections))
 
-    # parse download specifications
-    specs = sorted(specs_from_config(cp, keys), key=spec_order(jump_list))
+    # parse download specifications, dropping disabled before ordering
+    specs = [spec for spec in specs_from_config(cp, keys) if spec.enabled]
+    specs.sort(key=spec_order(jump_list))
 
     data = DownloadData(
         python_exe = python_exe,
@@ -322,36 +369,145 @@ def parse_main(cp, jump_list=None):
     )
     return data
 
-def run(dlargs, config, jump_list=None, dry=False, use_intervals=True, no_rtouch=False):
+def wait_any(processes, timeout=None):
+    """
+    Wait up to `timeout` seconds for any of `processes` to exit, without
+    reaping them.
+    """
+    if len(processes) == 1:
+        try:
+            processes[0].wait(timeout)
+        except subprocess.TimeoutExpired:
+            pass
+        return
+    # a pidfd becomes readable when its process exits
+    pidfds = [os.pidfd_open(process.pid) for process in processes]
+    try:
+        with selectors.DefaultSelector() as selector:
+            for pidfd in pidfds:
+                selector.register(pidfd, selectors.EVENT_READ)
+            selector.select(timeout)
+    finally:
+        for pidfd in pidfds:
+            os.close(pidfd)
+
+def reap_finished(active, use_rtouch):
+    """
+    Wait for a download in `active` to finish or reach its deadline, then
+    remove the finished and timed out ones. Return true if any finished on
+    their own.
+
+    :param active: list of (process, deadline) tuples.
+    :param use_rtouch: rtouch after each download finishing on its own.
+    """
+    deadlines = [deadline for _, deadline in active if deadline is not None]
+    if deadlines:
+        timeout = max(0, min(deadlines) - time.monotonic())
+    else:
+        timeout = None
+    wait_any([process for process, _ in active], timeout)
+
+    still_active = []
+    finished = False
+    for process, deadline in active:
+        if process.poll() is None:
+            if deadline is None or time.monotonic() < deadline:
+                still_active.append((process, deadline))
+                continue
+            # timed out, kill like subprocess.run does
+            process.kill()
+            process.wait()
+        else:
+            finished = True
+            if use_rtouch and rtouch:
+                rtouch.run(root_path=os.getcwd())
+    active[:] = still_active
+    return finished
+
+def run_downloads(downloads, dlargs, use_intervals, use_rtouch, parallel=1):
+    """
+    Run the enabled specs' downloads, up to `parallel` at the same time.
+    """
+    active = []
+    # parallel downloads are still writing files when one finishes, so
+    # rtouch once after they are all done instead of after each
+    rtouch_each = use_rtouch and parallel == 1
+    finished = False
+    # shared by specs until a download takes up time
+    now = datetime.datetime.now()
+    try:
+        for spec in downloads.iter_enabled_specs():
+            if len(active) >= parallel:
+                while len(active) >= parallel:
+                    finished |= reap_finished(active, rtouch_each)
+                # time passed downloading, keep interval timeouts accurate
+                now = datetime.datetime.now()
+            args, kwargs = spec.cmdargs(dlargs, downloads, use_intervals, now)
+            timeout = kwargs.pop('timeout', None)
+            deadline = None
+            if timeout is not None:
+                print(f'{timeout=}')
+                deadline = time.monotonic() + timeout
+            active.append((subprocess.Popen(args, **kwargs), deadline))
+        while active:
+            finished |= reap_finished(active, rtouch_each)
+    except KeyboardInterrupt:
+        # stop starting downloads
+        pass
+    finally:
+        # leave nothing running on interrupt or error
+        for process, _ in active:
+            process.terminate()
+        for process, _ in active:
+            process.wait()
+    if finished and use_rtouch and not rtouch_each and rtouch:
+        rtouch.run(root_path=os.getcwd())
+
+def run(
+    dlargs,
+    config,
+    jump_list = None,
+    dry = False,
+    use_intervals = True,
+    no_rtouch = False,
+    parallel = 1,
+):
     """
     Download the configured urls.
 
     :param dlargs: extra command line arguments passed on to yt-dlp.
+    :param parallel: number of downloads to run at the same time.
     """
+    # import here to keep it out of startup when only importing this module
+    import configparser
+
+    if needs_interpolation(config):
+        interpolation = configparser.ExtendedInterpolation()
+    else:
+        # nothing to interpolate, skip resolving on every option read
+        interpolation = None
     cp = configparser.ConfigParser(
         default_section = 'downloads',
-        interpolation = configparser.ExtendedInterpolation(),
+        interpolation = interpolation,
     )
     cp.read(config)
     downloads = parse_main(cp, jump_list)
-    use_rtouch = not no_rtouch
-    for spec in downloads.iter_enabled_specs():
-        args, kwargs = spec.cmdargs(dlargs, downloads, use_intervals)
-        if dry:
+    if dry:
+        now = datetime.datetime.now()
+        for spec in downloads.iter_enabled_specs():
+            args, kwargs = spec.cmdargs(dlargs, downloads, use_intervals, now)
             print(subprocess.list2cmdline(map(str, args)), end='\n\n')
-            continue
-        if 'timeout' in kwargs:
-            timeout = kwargs['timeout']
-            print(f'{timeout=}')
-        try:
-            completed = subprocess.run(args, **kwargs)
-        except subprocess.TimeoutExpired:
-            pass
-        except KeyboardInterrupt:
-            break
-        else:
-            if use_rtouch and rtouch:
-                rtouch.run(root_path=os.getcwd())
+    else:
+        use_rtouch = not no_rtouch
+        run_downloads(downloads, dlargs, use_intervals, use_rtouch, parallel)
+
+def parallel_type(string):
+    value = int(string)
+    if value < 1:
+        raise argparse.ArgumentTypeError('must be at least 1')
+    if value > 1 and not hasattr(os, 'pidfd_open'):
+        raise argparse.ArgumentTypeError('above 1 needs os.pidfd_open (Linux)')
+    return value
 
 def main(argv=None):
     parser = argparse.ArgumentParser()
@@ -376,6 +532,12 @@ def main(argv=None):
         action = 'store_true',
         help = 'Disable rtouching the top dir.',
     )
+    parser.add_argument(
+        '--parallel',
+        type = parallel_type,
+        default = 1,
+        help = 'Number of downloads to run at the same time. Default 1.',
+    )
     args, dlargs = parser.parse_known_args(argv)
     run(
         dlargs,
@@ -384,6 +546,7 @@ def main(argv=None):
         dry = args.dry,
         use_intervals = not args.no_intervals,
         no_rtouch = args.no_rtouch,
+        parallel = args.parallel,
     )
 
 if __name__ == '__main__':
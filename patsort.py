@@ -2,25 +2,28 @@
 import argparse
 import os
 import re
+import sys
 
-def run(files, pattern=None):
-    key = None
-    filter_func = None
+from operator import itemgetter
 
-    if pattern:
-        key_re = re.compile(pattern)
-        filter_func = key_re.search
-        def key(path):
-            match = filter_func(path)
-            if match:
-                return match.groups()
-            else:
-                return (path,)
+def run(files, pattern=None):
+    key_re = re.compile(pattern) if pattern else None
+    write = sys.stdout.write
 
     for ls_path in files:
-        paths = filter(filter_func, os.listdir(ls_path))
-        for path in sorted(paths, key=key):
-            print(path)
+        paths = os.listdir(ls_path)
+        if key_re:
+            # search once, keeping matching paths with their sort key
+            decorated = []
+            for path in paths:
+                match = key_re.search(path)
+                if match:
+                    decorated.append((match.groups(), path))
+            decorated.sort(key=itemgetter(0))
+            paths = [path for _, path in decorated]
+        else:
+            paths.sort()
+        write(''.join(f'{path}\n' for path in paths))
 
 def main(argv=None):
     """
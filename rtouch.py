@@ -15,43 +15,53 @@ def st_mtime(path):
 
 def walk_files(root, exclude=None):
     """
+    Recursively yield os.DirEntry objects for files under `root`. The
+    entries cache their stat results.
+
     :param exclude:
-        Called on filename return true to ignore.
+        Called on filename return true to ignore. None to keep all files.
     """
-    if exclude is None:
-        exclude = lambda filename: False
-    for dirpath, dirnames, filenames in os.walk(root):
-        for filename in filenames:
-            if exclude(filename):
-                continue
-            yield Path(os.path.join(dirpath, filename))
+    try:
+        scandir_it = os.scandir(root)
+    except OSError:
+        # unreadable directory, same as os.walk
+        return
+    with scandir_it:
+        for entry in scandir_it:
+            if entry.is_dir():
+                # like os.walk, do not follow symlinks to directories
+                if not entry.is_symlink():
+                    yield from walk_files(entry.path, exclude)
+            elif exclude is None or not exclude(entry.name):
+                yield entry
 
 def run(root_path, dry_run=False, exclude=None, report=False):
     """
     Update directories of `root_path` mtime to that of its newest file.
     """
-    for child_dir in Path(root_path).iterdir():
-        if not child_dir.is_dir():
-            # skip non-directories
-            continue
-        # Recursively find the newest file in this child dir of root.
-        newest_file = max(walk_files(child_dir, exclude), default=no_files, key=st_mtime)
-        if newest_file is no_files:
-            # skip for no files
-            continue
-        if newest_file.stat().st_mtime <= child_dir.stat().st_mtime:
-            # skip for newest file is not newer than directory
-            continue
-        if report:
-            print(child_dir)
-            print(f'\t{newest_file}')
-            print(f'\tParent: {datetime.fromtimestamp(child_dir.stat().st_mtime)}')
-            print(f'\tNewest: {datetime.fromtimestamp(newest_file.stat().st_mtime)}')
-        if not dry_run:
-            # update mtime, keeping atime
-            atime = child_dir.stat().st_atime
+    with os.scandir(root_path) as scandir_it:
+        for child_dir in scandir_it:
+            if not child_dir.is_dir():
+                # skip non-directories
+                continue
+            # Recursively find the newest file in this child dir of root.
+            newest_file = max(walk_files(child_dir.path, exclude), default=no_files, key=st_mtime)
+            if newest_file is no_files:
+                # skip for no files
+                continue
+            child_stat = child_dir.stat()
             newest_mtime = newest_file.stat().st_mtime
-            os.utime(child_dir, (atime, newest_mtime))
+            if newest_mtime <= child_stat.st_mtime:
+                # skip for newest file is not newer than directory
+                continue
+            if report:
+                print(child_dir.path)
+                print(f'\t{newest_file.path}')
+                print(f'\tParent: {datetime.fromtimestamp(child_stat.st_mtime)}')
+                print(f'\tNewest: {datetime.fromtimestamp(newest_mtime)}')
+            if not dry_run:
+                # update mtime, keeping atime
+                os.utime(child_dir.path, (child_stat.st_atime, newest_mtime))
 
 def root_type(string):
     return Path(string).resolve()
@@ -91,12 +101,27 @@ def argument_parser():
     )
     return parser
 
+def suffix_from_pattern(pattern):
+    """
+    Return the literal suffix of a `*suffix` shell pattern or None.
+    """
+    if pattern.startswith('*'):
+        suffix = pattern[1:]
+        if suffix and not any(char in suffix for char in '*?['):
+            return suffix
+
 def exclude_from_args(args):
     if args.exclude:
-        patterns = '|'.join(map(fnmatch.translate, args.exclude))
-        exclude = re.compile(patterns).match
+        suffixes = tuple(map(suffix_from_pattern, args.exclude))
+        if None not in suffixes:
+            # simple `*.ext` patterns, avoid regex
+            exclude = lambda filename: filename.endswith(suffixes)
+        else:
+            patterns = '(?:' + ')|(?:'.join(map(fnmatch.translate, args.exclude)) + ')'
+            exclude = re.compile(patterns).match
     else:
-        exclude = lambda filename: False
+        # nothing to call per filename
+        exclude = None
 
     return exclude
 